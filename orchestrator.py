@@ -2,13 +2,21 @@
 
 import asyncio
 import hashlib
+import hmac
 import json
 import os
+import random
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, OrderedDict, deque
 from typing import Any
 
 import httpx
 import redis.asyncio as aioredis
-from fastapi import FastAPI, Body
+from fastapi import FastAPI, Body, HTTPException, Request
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
@@ -18,6 +26,39 @@ load_dotenv()
 # Config
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+# Point at a local stand-in for the Gemini API when testing
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+# Register the brief once as cached content and have every agent reference it
+BRIEF_CONTEXT_CACHE = os.getenv("BRIEF_CONTEXT_CACHE", "false").lower() in ("1", "true", "yes")
+BRIEF_CACHE_TTL = int(os.getenv("BRIEF_CACHE_TTL", "3600"))
+# The API rejects contexts below the model's minimum cacheable size, so don't try
+BRIEF_CACHE_MIN_TOKENS = int(os.getenv("BRIEF_CACHE_MIN_TOKENS", "4096"))
+# After a failed create, use inline prompts for this long before trying again
+BRIEF_CACHE_RETRY_AFTER = int(os.getenv("BRIEF_CACHE_RETRY_AFTER", "600"))
+# Admission control for /create_project
+MAX_INFLIGHT_PROJECTS = int(os.getenv("MAX_INFLIGHT_PROJECTS", "8"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "16"))
+ADMISSION_QUEUE_PER_CLIENT = int(os.getenv("ADMISSION_QUEUE_PER_CLIENT", "4"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2.0"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+# Profiling and event-loop monitoring; /debug endpoints and X-Profile need ADMIN_TOKEN
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+LOOP_MONITOR = os.getenv("LOOP_MONITOR", "true").lower() in ("1", "true", "yes")
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.25"))
+# Stale-while-revalidate for agent outputs: served fresh until the soft TTL,
+# served stale (with one background refresh) until the hard TTL
+AGENT_SOFT_TTL = int(os.getenv("AGENT_SOFT_TTL", "3600"))
+AGENT_HARD_TTL = int(os.getenv("AGENT_HARD_TTL", str(6 * 3600)))
+AGENT_TTL_JITTER = float(os.getenv("AGENT_TTL_JITTER", "0.1"))
+# Must stay well above a refresh's worst case (cache create + cached attempt + inline retry ~130s);
+# refreshes are cut off at 80% of it so the lock never expires under a running refresh
+REFRESH_LOCK_TTL = int(os.getenv("REFRESH_LOCK_TTL", "300"))
+# Per-worker cap on concurrent background refreshes; stale hits beyond it just serve stale
+MAX_BACKGROUND_REFRESHES = int(os.getenv("MAX_BACKGROUND_REFRESHES", "4"))
 
 # Validate configuration
 if not GEMINI_API_KEY:
@@ -28,18 +69,10 @@ app = FastAPI(title="HackAI Orchestrator", description="AI-powered project gener
 
 # Mount static files
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 # in orchestrator.py
 from fastapi.middleware.cors import CORSMiddleware
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # or ["http://127.0.0.1:8000"] for more restrictive
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 import os
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -332,15 +365,255 @@ async def startup_event():
         print("⚠️  Running without Redis caching...")
 
 
+# Profiling and event-loop monitoring
+def collapse_stack(frame) -> str:
+    """Render a frame chain root-first in the folded format flame graph tools read."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack from a helper thread and counts collapsed stacks.
+
+    Pointed at the event-loop thread it sees everything the loop runs while it is
+    active, including other requests and idle time spent in the selector.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="hackai-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[collapse_stack(frame)] += 1
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.counts.most_common()) + "\n"
+
+
+class LoopLagMonitor:
+    """Measures event-loop lag and logs the loop's stack when a callback blocks it.
+
+    A coroutine wakes every interval and records how late it was; a watchdog
+    thread notices when that heartbeat stops and dumps the loop thread's stack
+    while the blocking callback is still running.
+    """
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.stats = {"samples": 0, "last_lag_ms": 0.0, "max_lag_ms": 0.0, "blocked": 0}
+        self.heartbeat = time.monotonic()
+        self.loop_thread: int | None = None
+        self._stop = threading.Event()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        threading.Thread(target=self._watch, name="hackai-loop-watchdog", daemon=True).start()
+        try:
+            while True:
+                started = loop.time()
+                await asyncio.sleep(self.interval)
+                lag = max(loop.time() - started - self.interval, 0.0)
+                self.heartbeat = time.monotonic()
+                self.stats["samples"] += 1
+                self.stats["last_lag_ms"] = round(lag * 1000, 2)
+                self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], self.stats["last_lag_ms"])
+        finally:
+            self._stop.set()
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(min(self.interval, self.threshold) / 2):
+            beat = self.heartbeat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or reported == beat:
+                continue
+            reported = beat
+            self.stats["blocked"] += 1
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>\n"
+            print(f"⚠️  Event loop blocked for {stalled * 1000:.0f}ms+, loop thread stack:\n{stack}")
+
+
+loop_monitor = LoopLagMonitor(LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD)
+background_tasks: set[asyncio.Task] = set()
+
+
+def is_admin_token(token: str) -> bool:
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def is_admin(request: Request) -> bool:
+    return is_admin_token(request.headers.get("x-admin-token", ""))
+
+
+def require_admin(request: Request):
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+def write_profile(name: str, folded: str):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, name), "w", encoding="utf-8") as f:
+        f.write(folded)
+    # Keep only the newest PROFILE_MAX_FILES profiles
+    paths = [os.path.join(PROFILE_DIR, n) for n in os.listdir(PROFILE_DIR) if n.endswith(".folded")]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for old in paths[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+
+def read_profile(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    """Start the event-loop lag monitor"""
+    if LOOP_MONITOR:
+        task = asyncio.create_task(loop_monitor.run())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+class ProfilingMiddleware:
+    """Profile a single request when it carries X-Profile: 1 and a valid X-Admin-Token.
+
+    Written as plain ASGI so requests without the header go straight to the app.
+    The profile id is sent as X-Profile-Id, and the profile is stored before the
+    last body chunk goes out so the id resolves as soon as the response ends.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        enabled, token = False, b""
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                enabled = value.strip().lower() in (b"1", b"true", b"yes", b"on")
+            elif name == b"x-admin-token":
+                token = value
+        if not enabled:
+            return await self.app(scope, receive, send)
+        if not is_admin_token(token.decode("latin-1")):
+            response = JSONResponse({"detail": "Admin token required"}, status_code=403)
+            return await response(scope, receive, send)
+
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.folded"
+        profiler = SamplingProfiler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL)
+        saved = False
+
+        async def save_profile():
+            nonlocal saved
+            if not saved:
+                saved = True
+                profiler.stop()
+                await asyncio.to_thread(write_profile, profile_id, profiler.folded())
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                headers = [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                await save_profile()
+            await send(message)
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            await save_profile()
+
+
+app.add_middleware(ProfilingMiddleware)
+# Added last so it wraps everything, including the profiler's own responses
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # or ["http://127.0.0.1:8000"] for more restrictive
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Profile-Id"],
+)
+
+
+@app.get("/debug/profiles/{name}")
+async def get_profile(name: str, request: Request):
+    """Download a stored profile in folded-stack format"""
+    require_admin(request)
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(await asyncio.to_thread(read_profile, path))
+
+
+@app.get("/debug/loop_lag")
+async def get_loop_lag(request: Request):
+    """Return event-loop lag statistics"""
+    require_admin(request)
+    return {"enabled": LOOP_MONITOR, "interval_s": LOOP_LAG_INTERVAL, "threshold_s": LOOP_BLOCK_THRESHOLD, **loop_monitor.stats}
+
+
 # Gemini client
+class GeminiHTTPError(Exception):
+    """Gemini API returned an HTTP error status"""
+
+    def __init__(self, status_code: int, message: str, detail: str = ""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.detail = detail
+
+    def cached_content_missing(self) -> bool:
+        """True when the API no longer has the cachedContent the call referenced.
+
+        Other 4xx errors (a bad prompt, a bad key) say nothing about the handle.
+        """
+        return self.status_code == 404 or (self.status_code == 403 and "cachedcontent" in self.detail.lower())
+
+
 class GeminiClient:
-    def __init__(self, api_key: str, model: str = "gemini-2.0-flash"):
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gemini-2.0-flash",
+        base_url: str = GEMINI_API_BASE,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
         self.api_key = api_key
         self.model = model
-        self.url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent"
+        self.base_url = base_url
+        # Lets tests route requests to an in-process stand-in (e.g. httpx.MockTransport)
+        self.transport = transport
+        self.url = f"{self.base_url}/models/{self.model}:generateContent"
 
-    async def generate(self, prompt: str, max_tokens: int = 1024):
-        """Generate content using Gemini API"""
+    async def generate(self, prompt: str, max_tokens: int = 1024, cached_content: str | None = None):
+        """Generate content using Gemini API, optionally on top of a cachedContents handle"""
         payload = {
             "contents": [{"parts": [{"text": prompt}]}],
             "generationConfig": {
@@ -350,11 +623,13 @@ class GeminiClient:
                 "topK": 10
             }
         }
+        if cached_content:
+            payload["cachedContent"] = cached_content
         
         params = {"key": self.api_key}
         headers = {"Content-Type": "application/json"}
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
+        async with httpx.AsyncClient(timeout=60.0, transport=self.transport) as client:
             try:
                 r = await client.post(self.url, json=payload, headers=headers, params=params)
                 r.raise_for_status()
@@ -370,30 +645,175 @@ class GeminiClient:
                 return "No response generated"
                 
             except httpx.HTTPStatusError as e:
-                raise Exception(f"API request failed: HTTP {e.response.status_code}")
+                raise GeminiHTTPError(
+                    e.response.status_code, f"API request failed: HTTP {e.response.status_code}", e.response.text
+                )
             except Exception as e:
                 raise Exception(f"Generation failed: {str(e)}")
 
+    async def create_cached_content(self, system_instruction: str, text: str, ttl: int) -> str:
+        """Register shared context via the cachedContents API and return its resource name"""
+        payload = {
+            "model": f"models/{self.model}",
+            "systemInstruction": {"parts": [{"text": system_instruction}]},
+            "contents": [{"role": "user", "parts": [{"text": text}]}],
+            "ttl": f"{ttl}s",
+        }
+        params = {"key": self.api_key}
+        headers = {"Content-Type": "application/json"}
 
-llm = GeminiClient(GEMINI_API_KEY)
+        async with httpx.AsyncClient(timeout=10.0, transport=self.transport) as client:
+            try:
+                r = await client.post(f"{self.base_url}/cachedContents", json=payload, headers=headers, params=params)
+                r.raise_for_status()
+                name = r.json().get("name")
+            except httpx.HTTPStatusError as e:
+                raise Exception(f"Context caching failed: HTTP {e.response.status_code}")
+            except Exception as e:
+                raise Exception(f"Context caching failed: {str(e)}")
+        if not name:
+            raise Exception("Context caching failed: no cachedContent name returned")
+        return name
 
 
-# Redis helpers
-async def cache_get(key: str):
-    val = await redis.get(key)
-    if val:
-        return json.loads(val)
-    return None
+llm = GeminiClient(GEMINI_API_KEY)
 
 
+# Redis helpers
 async def cache_set(key: str, value: Any, ttl: int = 3600):
     await redis.set(key, json.dumps(value), ex=ttl)
 
 
+# Delete a key only while it still holds the value we expect
+COMPARE_AND_DELETE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+async def delete_if_equals(key: str, value: str) -> bool:
+    return bool(await redis.eval(COMPARE_AND_DELETE, 1, key, value))
+
+
+def agent_ttls(agent: str, soft: int, hard: int) -> tuple[int, int]:
+    """(soft, hard) TTLs for an agent; AGENT_TTL_<NAME>="soft,hard" overrides the defaults."""
+    override = os.getenv(f"AGENT_TTL_{agent.upper()}")
+    if override:
+        soft, hard = (int(part) for part in override.split(","))
+    return soft, hard
+
+
+# Per-agent (soft, hard) TTLs in seconds. Ideas and research references for a
+# brief age slowly, so they stay fresh longer than plans, code and pitches.
+AGENT_TTLS = {
+    "planner": agent_ttls("planner", AGENT_SOFT_TTL, AGENT_HARD_TTL),
+    "ideation": agent_ttls("ideation", 4 * AGENT_SOFT_TTL, 4 * AGENT_HARD_TTL),
+    "research": agent_ttls("research", 4 * AGENT_SOFT_TTL, 4 * AGENT_HARD_TTL),
+    "planning": agent_ttls("planning", AGENT_SOFT_TTL, AGENT_HARD_TTL),
+    "coding": agent_ttls("coding", AGENT_SOFT_TTL, AGENT_HARD_TTL),
+    "presentation": agent_ttls("presentation", AGENT_SOFT_TTL, AGENT_HARD_TTL),
+    "evaluator": agent_ttls("evaluator", AGENT_SOFT_TTL, AGENT_HARD_TTL),
+}
+# Keys this worker is already refreshing
+refreshing: set[str] = set()
+
+
+def jittered(ttl: int) -> int:
+    """Spread expiries so keys written together don't all go stale together."""
+    return max(int(ttl * random.uniform(1 - AGENT_TTL_JITTER, 1 + AGENT_TTL_JITTER)), 1)
+
+
+def decode_entry(val):
+    """Return (value, fresh) for a raw agent entry, or (None, False) on a miss."""
+    if not val:
+        return None, False
+    entry = json.loads(val)
+    if isinstance(entry, dict) and "soft_expires" in entry:
+        return entry.get("value"), time.time() < entry["soft_expires"]
+    # Entries written before soft TTLs existed are served once and refreshed
+    return entry, False
+
+
+async def swr_get(key: str):
+    return decode_entry(await redis.get(key))
+
+
+async def swr_set(agent: str, key: str, value: Any):
+    soft, hard = AGENT_TTLS[agent]
+    soft = jittered(soft)
+    hard = max(jittered(hard), soft + 1)
+    entry = {"value": value, "soft_expires": time.time() + soft}
+    await redis.set(key, json.dumps(entry), ex=hard)
+
+
+async def refresh_agent(agent: str, key: str, compute, token: str):
+    try:
+        out = await asyncio.wait_for(compute(), timeout=REFRESH_LOCK_TTL * 0.8)
+        # Keep serving the stale value rather than replacing it with an error;
+        # the refresh lock then throttles retries to one per REFRESH_LOCK_TTL
+        if "error" in out:
+            return
+        await swr_set(agent, key, out)
+        # Only release the lock if it is still ours
+        await delete_if_equals(f"{key}:refresh", token)
+    except Exception as e:
+        print(f"⚠️  Background refresh of {key} failed: {e}")
+    finally:
+        refreshing.discard(key)
+        admission.release()
+
+
+async def schedule_refresh(agent: str, key: str, compute):
+    """Start one background refresh per key, deduplicated across workers by a Redis lock.
+
+    Each refresh holds an admission slot for as long as it runs, so refreshes
+    share the /create_project budget. When no slot is free the refresh is
+    skipped and the stale value keeps being served.
+    """
+    if key in refreshing or len(refreshing) >= MAX_BACKGROUND_REFRESHES:
+        return
+    if not admission.try_acquire():
+        return
+    refreshing.add(key)
+    token = uuid.uuid4().hex
+    try:
+        acquired = await redis.set(f"{key}:refresh", token, nx=True, ex=REFRESH_LOCK_TTL)
+    except Exception:
+        acquired = False
+    if not acquired:
+        refreshing.discard(key)
+        admission.release()
+        return
+    task = asyncio.create_task(refresh_agent(agent, key, compute, token))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def cached_agent(agent: str, key: str, compute):
+    """Serve an agent result from cache, revalidating stale entries in the background."""
+    cached, fresh = await swr_get(key)
+    if cached:
+        if not fresh:
+            await schedule_refresh(agent, key, compute)
+        return cached
+    out = await compute()
+    # Like refresh_agent, never store errors: a transient failure would otherwise
+    # look fresh for the whole soft TTL and never be retried
+    if "error" not in out:
+        await swr_set(agent, key, out)
+    return out
+
+
 def prompt_hash(prompt: str) -> str:
     return hashlib.sha256(prompt.encode()).hexdigest()
 
 
+def agent_key(project_id: str, agent: str, prompt: str) -> str:
+    return f"hackmate:{project_id}:{agent}:{prompt_hash(prompt)}"
+
+
 def try_parse_json(text: str):
     """Best-effort JSON extraction from LLM text. Returns parsed object or None."""
     if not text or not isinstance(text, str):
@@ -438,6 +858,126 @@ def try_parse_json(text: str):
     return None
 
 
+# Shared brief context caching
+SHARED_SYSTEM_INSTRUCTION = (
+    "You are one of several HackAI assistants helping a hackathon team turn a project brief "
+    "into ideas, research, plans, code and a pitch. The project brief is provided in this context. "
+    "When asked for JSON, return only valid JSON."
+)
+# Stands in for the brief inside prompts that run on top of the cached context
+BRIEF_REFERENCE = "the project brief provided in the context above"
+
+
+# Redis markers stored in place of a handle while it's being created or after creation failed
+BRIEF_CACHE_PENDING = "__pending__"
+BRIEF_CACHE_UNAVAILABLE = "__unavailable__"
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+async def resolve_brief_cache(key: str, brief: str) -> str | None:
+    """Look up the shared cachedContents handle for a brief, creating it if nobody has.
+
+    Creation is claimed with SET NX so concurrent requests and workers don't each
+    create (and pay storage for) their own copy. A failure leaves an "unavailable"
+    marker so later requests go straight to inline prompts for a while.
+    """
+    try:
+        name = await redis.get(key)
+        if name is not None:
+            name = name.decode() if isinstance(name, bytes) else name
+            return None if name in (BRIEF_CACHE_PENDING, BRIEF_CACHE_UNAVAILABLE) else name
+        if not await redis.set(key, BRIEF_CACHE_PENDING, nx=True, ex=60):
+            return None
+    except Exception:
+        # Without Redis the handle can't be shared, so don't create one
+        return None
+
+    try:
+        name = await llm.create_cached_content(SHARED_SYSTEM_INSTRUCTION, f"Project brief:\n{brief}", BRIEF_CACHE_TTL)
+    except Exception as e:
+        print(f"⚠️  Brief context caching unavailable, using inline prompts: {e}")
+        try:
+            await redis.set(key, BRIEF_CACHE_UNAVAILABLE, ex=BRIEF_CACHE_RETRY_AFTER)
+        except Exception:
+            pass
+        return None
+    try:
+        # Expire our handle a little before the API does so we never hand out a dead one
+        await redis.set(key, name, ex=max(BRIEF_CACHE_TTL - 60, 1))
+    except Exception:
+        pass
+    return name
+
+
+class BriefContext:
+    """Lazily resolved brief cache handle shared by the agents of one request.
+
+    Nothing is looked up or created until an agent actually has to call the LLM,
+    so requests served entirely from Redis never touch the cachedContents API.
+    Returns None when caching is disabled, the brief is too small to cache, or
+    the cache is unavailable; agents then fall back to inline prompts.
+    """
+
+    def __init__(self, project_id: str, brief: str):
+        self.key = f"hackmate:{project_id}:brief_cache:{prompt_hash(brief)}"
+        self.brief = brief
+        self._task: asyncio.Task | None = None
+        self._dead = False
+
+    async def handle(self) -> str | None:
+        if not BRIEF_CONTEXT_CACHE or self._dead:
+            return None
+        if estimate_tokens(SHARED_SYSTEM_INSTRUCTION + self.brief) < BRIEF_CACHE_MIN_TOKENS:
+            return None
+        if self._task is None:
+            self._task = asyncio.create_task(resolve_brief_cache(self.key, self.brief))
+        return await asyncio.shield(self._task)
+
+    async def invalidate(self, handle: str):
+        """Stop using a handle the API rejected, here and for every other request."""
+        if self._dead:
+            return
+        self._dead = True
+        try:
+            await delete_if_equals(self.key, handle)
+        except Exception:
+            pass
+
+
+async def run_llm(prompt: str, cached_prompt: str | None = None, brief_ctx: BriefContext | None = None):
+    """Run one agent prompt and wrap the result as {raw, parsed} or {error}.
+
+    When the brief is cached the shorter cached_prompt is sent instead of the
+    inline prompt; if that call fails the inline prompt is retried.
+    """
+    try:
+        text = None
+        brief_cache = await brief_ctx.handle() if brief_ctx and cached_prompt else None
+        if brief_cache:
+            try:
+                text = await llm.generate(cached_prompt, cached_content=brief_cache)
+            except GeminiHTTPError as e:
+                # Only drop the shared handle when the API says it's gone; any other
+                # error just sends this call inline
+                if e.cached_content_missing():
+                    await brief_ctx.invalidate(brief_cache)
+                print(f"⚠️  Cached brief request failed, retrying inline: {e}")
+            except Exception as e:
+                print(f"⚠️  Cached brief request failed, retrying inline: {e}")
+        if text is None:
+            text = await llm.generate(prompt)
+        parsed = try_parse_json(text)
+        out = {"raw": text}
+        if parsed is not None:
+            out["parsed"] = parsed
+    except Exception as e:
+        out = {"error": str(e)}
+    return out
+
+
 # Request model
 class ProjectRequest(BaseModel):
     title: str
@@ -445,191 +985,246 @@ class ProjectRequest(BaseModel):
     time_hours: int = 24
 
 
-async def planner_agent(project_id: str, brief: str, time_hours: int):
-    prompt = (
+# Prompt builders; agents call them with BRIEF_REFERENCE when the brief is cached
+def planner_prompt(brief: str, time_hours: int) -> str:
+    return (
         f"Plan tasks for the project based on the brief: {brief}. "
         f"Return a JSON with keys: nodes (list of tasks with id, title, description, estimate_hours), "
         f"and edges (list of {{from,to}}). Budget {time_hours} hours."
     )
-    key = f"hackmate:{project_id}:planner:{prompt_hash(prompt)}"
-    cached = await cache_get(key)
-    if cached:
-        return cached
-    try:
-        text = await llm.generate(prompt)
-        parsed = try_parse_json(text)
-        out = {"raw": text}
-        if parsed is not None:
-            out["parsed"] = parsed
-    except Exception as e:
-        out = {"error": str(e)}
-    await cache_set(key, out)
-    return out
 
 
-async def evaluator_agent(project_id: str, title: str, brief: str):
-    prompt = (
+def evaluator_prompt(title: str, brief: str) -> str:
+    return (
         f"Evaluate the project idea '{title}'. Brief: {brief}. Return JSON with keys: risks (list), feasibility (low/medium/high), impact (1-10), recommendations (list)."
     )
-    key = f"hackmate:{project_id}:evaluator:{prompt_hash(prompt)}"
-    cached = await cache_get(key)
-    if cached:
-        return cached
-    try:
-        text = await llm.generate(prompt)
-        parsed = try_parse_json(text)
-        out = {"raw": text}
-        if parsed is not None:
-            out["parsed"] = parsed
-    except Exception as e:
-        out = {"error": str(e)}
-    await cache_set(key, out)
-    return out
-async def ideation_agent(project_id: str, brief: str):
-    prompt = (
+
+
+def ideation_prompt(brief: str) -> str:
+    return (
         f"You are an ideation assistant. Given the brief:\n{brief}\n"
         f"Produce 6 distinct hackathon project ideas as JSON list of "
         f"{{title, pitch, tech, novelty}}."
     )
-    key = f"hackmate:{project_id}:ideation:{prompt_hash(prompt)}"
-    cached = await cache_get(key)
-    if cached:
-        return cached
-    try:
-        text = await llm.generate(prompt)
-        parsed = try_parse_json(text)
-        out = {"raw": text}
-        if parsed is not None:
-            out["parsed"] = parsed
-    except Exception as e:
-        out = {"error": str(e)}
-    await cache_set(key, out)
-    return out
 
 
-async def research_agent(project_id: str, idea: str):
-    prompt = (
+def research_prompt(idea: str) -> str:
+    return (
         f"Research for idea: {idea}. Provide 5 papers or URLs, 3 APIs, "
         f"3 libraries, short summaries in JSON."
     )
-    key = f"hackmate:{project_id}:research:{prompt_hash(prompt)}"
-    cached = await cache_get(key)
-    if cached:
-        return cached
-    try:
-        text = await llm.generate(prompt)
-        parsed = try_parse_json(text)
-        out = {"raw": text}
-        if parsed is not None:
-            out["parsed"] = parsed
-    except Exception as e:
-        out = {"error": str(e)}
-    await cache_set(key, out)
-    return out
 
 
-async def planning_agent(project_id: str, idea: str, time_hours: int):
-    prompt = (
+def planning_prompt(idea: str, time_hours: int) -> str:
+    return (
         f"Plan a roadmap for idea {idea} in {time_hours} hours: milestones, "
         f"tasks, owners, estimates in JSON."
     )
-    key = f"hackmate:{project_id}:planning:{prompt_hash(prompt)}"
-    cached = await cache_get(key)
-    if cached:
-        return cached
-    try:
-        text = await llm.generate(prompt)
-        parsed = try_parse_json(text)
-        out = {"raw": text}
-        if parsed is not None:
-            out["parsed"] = parsed
-    except Exception as e:
-        out = {"error": str(e)}
-    await cache_set(key, out)
-    return out
 
 
-async def coding_agent(project_id: str, idea: str):
-    prompt = f"Generate a starter repo for idea {idea}: README, requirements, app.py skeleton and one example file."
-    key = f"hackmate:{project_id}:coding:{prompt_hash(prompt)}"
-    cached = await cache_get(key)
-    if cached:
-        return cached
-    try:
-        text = await llm.generate(prompt)
-        parsed = try_parse_json(text)
-        out = {"raw": text}
-        if parsed is not None:
-            out["parsed"] = parsed
-    except Exception as e:
-        out = {"error": str(e)}
-    await cache_set(key, out)
-    return out
+def coding_prompt(idea: str) -> str:
+    return f"Generate a starter repo for idea {idea}: README, requirements, app.py skeleton and one example file."
 
 
-async def presentation_agent(project_id: str, idea: str):
-    prompt = (
+def presentation_prompt(idea: str) -> str:
+    return (
         f"Create 6 slide outlines and a 200-word pitch for {idea}. Include demo script and resources. "
         f"Return a JSON object with keys: slides_outline, pitch, demo_script, resources. "
         f"If possible, also create shareable slides and include a publicly accessible PPTX download URL as 'slides_link'. "
         f"If not possible, set 'slides_link' to null."
     )
-    key = f"hackmate:{project_id}:presentation:{prompt_hash(prompt)}"
-    cached = await cache_get(key)
-    if cached:
-        return cached
-    try:
-        text = await llm.generate(prompt)
-        parsed = try_parse_json(text)
-        out = {"raw": text}
-        if parsed is not None:
-            out["parsed"] = parsed
-            # Bubble up a potential slides link if present
-            slides_link = parsed.get("slides_link") if isinstance(parsed, dict) else None
-            if slides_link:
-                out["slides_link"] = slides_link
-    except Exception as e:
-        out = {"error": str(e)}
-    await cache_set(key, out)
+
+
+def with_slides_link(out: dict) -> dict:
+    """Bubble up a potential slides link if present"""
+    parsed = out.get("parsed")
+    slides_link = parsed.get("slides_link") if isinstance(parsed, dict) else None
+    if slides_link:
+        out["slides_link"] = slides_link
     return out
 
 
-# Main endpoint
-@app.post("/create_project")
-async def create_project(req: ProjectRequest):
-    project_id = hashlib.sha1((req.title + req.brief).encode()).hexdigest()[:8]
+# The prompt each agent runs for a request, in response order. run_project and
+# the admission bypass check both derive agent cache keys from this table.
+AGENT_PROMPTS = {
+    "planner": lambda req, brief: planner_prompt(brief, req.time_hours),
+    "ideation": lambda req, brief: ideation_prompt(brief),
+    "research": lambda req, brief: research_prompt(brief),
+    "planning": lambda req, brief: planning_prompt(brief, req.time_hours),
+    "coding": lambda req, brief: coding_prompt(brief),
+    "presentation": lambda req, brief: presentation_prompt(brief),
+    "evaluator": lambda req, brief: evaluator_prompt(req.title, brief),
+}
+AGENT_POSTPROCESS = {
+    "presentation": with_slides_link,
+}
+
+
+def project_agent_keys(project_id: str, req: ProjectRequest) -> dict[str, str]:
+    """Cache key of every agent result for a request, by agent name."""
+    return {agent: agent_key(project_id, agent, build(req, req.brief)) for agent, build in AGENT_PROMPTS.items()}
+
+
+async def run_agent(project_id: str, agent: str, req: ProjectRequest, brief_ctx: BriefContext | None = None):
+    build = AGENT_PROMPTS[agent]
+    prompt = build(req, req.brief)
+    key = agent_key(project_id, agent, prompt)
+    postprocess = AGENT_POSTPROCESS.get(agent)
+
+    async def compute():
+        out = await run_llm(prompt, build(req, BRIEF_REFERENCE), brief_ctx)
+        return postprocess(out) if postprocess else out
+
+    return await cached_agent(agent, key, compute)
+
+
+# Admission control
+class AdmissionController:
+    """Bounded in-flight budget with a short wait queue, served round-robin per client.
+
+    acquire() admits immediately while under budget, otherwise parks the caller
+    in its client's queue for up to queue_timeout seconds. Each client may hold
+    at most max_queue_per_client waiting requests, and when the shared queue is
+    full a client with fewer waiters displaces the newest waiter of the busiest
+    client, so one noisy client can't starve the rest. acquire() returns False
+    when the request is shed so the caller can reject it.
+    """
+
+    def __init__(self, max_inflight: int, max_queue: int, max_queue_per_client: int, queue_timeout: float):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.queue_timeout = queue_timeout
+        self.inflight = 0
+        self.queued = 0
+        self.waiters: "OrderedDict[str, deque[asyncio.Future]]" = OrderedDict()
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now, without queueing."""
+        if self.inflight < self.max_inflight and not self.waiters:
+            self.inflight += 1
+            return True
+        return False
+
+    async def acquire(self, client: str) -> bool:
+        if self.inflight < self.max_inflight and not self.waiters:
+            self.inflight += 1
+            return True
+        waiting = len(self.waiters.get(client, ()))
+        if waiting >= self.max_queue_per_client:
+            return False
+        if self.queued >= self.max_queue and not self._shed_busiest(waiting):
+            return False
+
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(client, deque()).append(fut)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.queue_timeout)
+            return fut.result()
+        except asyncio.TimeoutError:
+            # The slot may have been handed over (or the wait shed) just as it expired
+            if fut.done():
+                return fut.result()
+            self._discard(client, fut)
+            return False
+        except BaseException:
+            if fut.done():
+                if fut.result():
+                    self.release()
+            else:
+                self._discard(client, fut)
+            raise
+
+    def _shed_busiest(self, waiting: int) -> bool:
+        """Make room for a client with `waiting` queued requests by shedding the
+        newest waiter of the busiest client, if that client holds more."""
+        busiest = max(self.waiters, key=lambda c: len(self.waiters[c]))
+        queue = self.waiters[busiest]
+        if len(queue) <= waiting + 1:
+            return False
+        queue.pop().set_result(False)
+        self.queued -= 1
+        return True
+
+    def release(self):
+        """Hand the slot to the next waiter (rotating across clients) or free it."""
+        while self.waiters:
+            client, queue = self.waiters.popitem(last=False)
+            fut = queue.popleft()
+            if queue:
+                self.waiters[client] = queue
+            self.queued -= 1
+            if not fut.done():
+                fut.set_result(True)
+                return
+        self.inflight -= 1
+
+    def _discard(self, client: str, fut: asyncio.Future):
+        queue = self.waiters.get(client)
+        if queue and fut in queue:
+            queue.remove(fut)
+            self.queued -= 1
+            if not queue:
+                del self.waiters[client]
+
+
+admission = AdmissionController(
+    MAX_INFLIGHT_PROJECTS, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_PER_CLIENT, ADMISSION_QUEUE_TIMEOUT
+)
+
 
-    tasks = [
-        asyncio.create_task(planner_agent(project_id, req.brief, req.time_hours)),
-        asyncio.create_task(ideation_agent(project_id, req.brief)),
-        asyncio.create_task(research_agent(project_id, req.brief)),
-        asyncio.create_task(planning_agent(project_id, req.brief, req.time_hours)),
-        asyncio.create_task(coding_agent(project_id, req.brief)),
-        asyncio.create_task(presentation_agent(project_id, req.brief)),
-        asyncio.create_task(evaluator_agent(project_id, req.title, req.brief)),
-    ]
-    results = await asyncio.gather(*tasks)
+async def is_fully_cached(project_id: str, req: ProjectRequest) -> bool:
+    """True when every agent result is in Redis, fresh or stale.
+
+    Stale hits are served immediately too; the background refreshes they start
+    take their own admission slots (see schedule_refresh).
+    """
+    keys = list(project_agent_keys(project_id, req).values())
+    try:
+        return await redis.exists(*keys) == len(keys)
+    except Exception:
+        return False
+
+
+async def run_project(project_id: str, req: ProjectRequest):
+    brief_ctx = BriefContext(project_id, req.brief)
+    results = await asyncio.gather(*(run_agent(project_id, agent, req, brief_ctx) for agent in AGENT_PROMPTS))
 
     agg = {
         "project_id": project_id,
         "title": req.title,
         "brief": req.brief,
         "time_hours": req.time_hours,
-        "agents": {
-            "planner": results[0],
-            "ideation": results[1],
-            "research": results[2],
-            "planning": results[3],
-            "coding": results[4],
-            "presentation": results[5],
-            "evaluator": results[6],
-        },
+        "agents": dict(zip(AGENT_PROMPTS, results)),
     }
 
     await cache_set(f"hackmate:{project_id}:aggregate", agg, ttl=24 * 3600)
     return agg
 
 
+# Main endpoint
+@app.post("/create_project")
+async def create_project(req: ProjectRequest, request: Request):
+    project_id = hashlib.sha1((req.title + req.brief).encode()).hexdigest()[:8]
+
+    # Fully cached requests are cheap, so they skip the in-flight budget
+    if await is_fully_cached(project_id, req):
+        return await run_project(project_id, req)
+
+    client = request.client.host if request.client else "unknown"
+    if not await admission.acquire(client):
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+        )
+    try:
+        return await run_project(project_id, req)
+    finally:
+        admission.release()
+
+
 # Artifacts helpers and endpoints
 def ensure_artifacts_dir(project_id: str) -> str:
     base = os.path.join("static", "artifacts", project_id)
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+
+class FakeRedis:
+    """In-memory stand-in for the few redis.asyncio calls the orchestrator makes."""
+
+    def __init__(self):
+        self.data: dict[str, bytes] = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    async def exists(self, *keys):
+        return sum(1 for k in keys if k in self.data)
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    async def delete(self, *keys):
+        return sum(1 for k in keys if self.data.pop(k, None) is not None)
+
+    async def eval(self, script, numkeys, key, value):
+        # Only the orchestrator's compare-and-delete script is used
+        if self.data.get(key) == value.encode():
+            del self.data[key]
+            return 1
+        return 0
+
+
+@pytest.fixture(scope="session")
+def orchestrator(tmp_path_factory):
+    # The app mounts ./static at import time
+    workdir = tmp_path_factory.mktemp("app")
+    (workdir / "static").mkdir()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import orchestrator as module
+    finally:
+        os.chdir(cwd)
+    return module
+
+
+@pytest.fixture
+def fake_redis(orchestrator, monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(orchestrator, "redis", fake)
+    return fake
@@ -0,0 +1,68 @@
+"""In-process stand-in for the Gemini endpoints the orchestrator calls.
+
+Route a GeminiClient to it through httpx.MockTransport:
+
+    standin = GeminiStandIn()
+    client = GeminiClient("key", base_url=standin.base_url, transport=standin.transport())
+"""
+
+import json
+
+import httpx
+
+
+def error_response(status_code: int, message: str, status: str) -> httpx.Response:
+    return httpx.Response(status_code, json={"error": {"code": status_code, "message": message, "status": status}})
+
+
+class GeminiStandIn:
+    """Serves POST /cachedContents and POST /models/<model>:generateContent.
+
+    Generated text is a JSON object saying whether the call used cached
+    content, so callers can tell cached and inline calls apart.
+    """
+
+    base_url = "http://gemini.test/v1beta"
+
+    def __init__(self):
+        self.caches: dict[str, dict] = {}
+        self.create_calls: list[dict] = []
+        self.generate_calls: list[dict] = []
+        # Set to (status_code, message, status) to make the matching calls fail
+        self.create_error: tuple[int, str, str] | None = None
+        self.generate_error: tuple[int, str, str] | None = None
+        # How a call that references an unknown cachedContent is rejected
+        self.missing_cache_error: tuple[int, str, str] = (404, "CachedContent not found", "NOT_FOUND")
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def expire(self, name: str):
+        """Drop a cached content server-side, as if its TTL ran out."""
+        self.caches.pop(name, None)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method != "POST":
+            return error_response(405, "Method not allowed", "INVALID_ARGUMENT")
+        body = json.loads(request.content)
+
+        if path.endswith("/cachedContents"):
+            self.create_calls.append(body)
+            if self.create_error:
+                return error_response(*self.create_error)
+            name = f"cachedContents/standin-{len(self.create_calls)}"
+            self.caches[name] = body
+            return httpx.Response(200, json={"name": name, "model": body.get("model")})
+
+        if path.endswith(":generateContent"):
+            self.generate_calls.append(body)
+            name = body.get("cachedContent")
+            if name is not None and name not in self.caches:
+                return error_response(*self.missing_cache_error)
+            if self.generate_error:
+                return error_response(*self.generate_error)
+            text = json.dumps({"cached": name is not None})
+            return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+        return error_response(404, f"Unknown endpoint {path}", "NOT_FOUND")
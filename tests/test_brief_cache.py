@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from gemini_standin import GeminiStandIn
+
+LONG_BRIEF = "Build an assistant that plans meals from what is in the fridge. " * 40
+
+
+@pytest.fixture
+def standin(orchestrator, fake_redis, monkeypatch):
+    standin = GeminiStandIn()
+    client = orchestrator.GeminiClient("test-key", base_url=standin.base_url, transport=standin.transport())
+    monkeypatch.setattr(orchestrator, "llm", client)
+    monkeypatch.setattr(orchestrator, "BRIEF_CONTEXT_CACHE", True)
+    monkeypatch.setattr(orchestrator, "BRIEF_CACHE_MIN_TOKENS", 100)
+    return standin
+
+
+def run_agents(orchestrator, ctx, count=7):
+    async def main():
+        return await asyncio.gather(*(orchestrator.run_llm("inline prompt", "cached prompt", ctx) for _ in range(count)))
+
+    return asyncio.run(main())
+
+
+def test_agents_share_one_cached_brief(orchestrator, standin, fake_redis):
+    ctx = orchestrator.BriefContext("p1", LONG_BRIEF)
+
+    outs = run_agents(orchestrator, ctx)
+
+    assert [out["parsed"] for out in outs] == [{"cached": True}] * 7
+    assert len(standin.create_calls) == 1
+    assert LONG_BRIEF in standin.create_calls[0]["contents"][0]["parts"][0]["text"]
+    handle = fake_redis.data[ctx.key].decode()
+    assert all(call["cachedContent"] == handle for call in standin.generate_calls)
+
+    # A later request for the same brief reuses the handle from Redis
+    run_agents(orchestrator, orchestrator.BriefContext("p1", LONG_BRIEF), count=1)
+    assert len(standin.create_calls) == 1
+
+
+def test_expired_handle_is_dropped_and_falls_back_inline(orchestrator, standin, fake_redis):
+    run_agents(orchestrator, orchestrator.BriefContext("p1", LONG_BRIEF), count=1)
+    standin.expire(fake_redis.data[orchestrator.BriefContext("p1", LONG_BRIEF).key].decode())
+
+    ctx = orchestrator.BriefContext("p1", LONG_BRIEF)
+    first = run_agents(orchestrator, ctx, count=1)[0]
+
+    assert first["parsed"] == {"cached": False}
+    assert ctx.key not in fake_redis.data
+
+    # The dead handle isn't sent again for the rest of the request
+    calls_before = len(standin.generate_calls)
+    second = run_agents(orchestrator, ctx, count=1)[0]
+    assert second["parsed"] == {"cached": False}
+    assert [call.get("cachedContent") for call in standin.generate_calls[calls_before:]] == [None]
+
+
+def test_permission_denied_on_cached_content_drops_handle(orchestrator, standin, fake_redis):
+    standin.missing_cache_error = (403, "CachedContent not found (or permission denied)", "PERMISSION_DENIED")
+    run_agents(orchestrator, orchestrator.BriefContext("p1", LONG_BRIEF), count=1)
+    ctx = orchestrator.BriefContext("p1", LONG_BRIEF)
+    standin.expire(fake_redis.data[ctx.key].decode())
+
+    out = run_agents(orchestrator, ctx, count=1)[0]
+
+    assert out["parsed"] == {"cached": False}
+    assert ctx.key not in fake_redis.data
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        (400, "Request contains an invalid argument.", "INVALID_ARGUMENT"),
+        (403, "Method doesn't allow unregistered callers.", "PERMISSION_DENIED"),
+        (429, "Resource has been exhausted.", "RESOURCE_EXHAUSTED"),
+    ],
+)
+def test_other_errors_keep_the_shared_handle(orchestrator, standin, fake_redis, error):
+    run_agents(orchestrator, orchestrator.BriefContext("p1", LONG_BRIEF), count=1)
+    ctx = orchestrator.BriefContext("p1", LONG_BRIEF)
+    handle = fake_redis.data[ctx.key]
+    standin.generate_error = error
+
+    out = run_agents(orchestrator, ctx, count=1)[0]
+
+    assert "error" in out
+    assert fake_redis.data[ctx.key] == handle
+
+
+def test_failed_create_marks_unavailable_and_uses_inline(orchestrator, standin, fake_redis):
+    standin.create_error = (400, "Cached content is too small", "INVALID_ARGUMENT")
+
+    outs = run_agents(orchestrator, orchestrator.BriefContext("p1", LONG_BRIEF))
+    assert [out["parsed"] for out in outs] == [{"cached": False}] * 7
+
+    ctx = orchestrator.BriefContext("p1", LONG_BRIEF)
+    assert fake_redis.data[ctx.key].decode() == orchestrator.BRIEF_CACHE_UNAVAILABLE
+    run_agents(orchestrator, ctx, count=1)
+    assert len(standin.create_calls) == 1
+
+
+def test_small_brief_skips_caching(orchestrator, standin, monkeypatch):
+    monkeypatch.setattr(orchestrator, "BRIEF_CACHE_MIN_TOKENS", 4096)
+
+    out = run_agents(orchestrator, orchestrator.BriefContext("p1", "A todo app"), count=1)[0]
+
+    assert out["parsed"] == {"cached": False}
+    assert standin.create_calls == []
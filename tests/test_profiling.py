@@ -0,0 +1,33 @@
+import pytest
+from fastapi.testclient import TestClient
+
+ORIGIN = {"Origin": "http://localhost:3000"}
+
+
+@pytest.fixture
+def client(orchestrator, tmp_path, monkeypatch):
+    monkeypatch.setattr(orchestrator, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(orchestrator, "PROFILE_DIR", str(tmp_path / "profiles"))
+    return TestClient(orchestrator.app)
+
+
+def test_profile_is_stored_before_the_response_completes(client):
+    headers = {**ORIGIN, "X-Profile": "1", "X-Admin-Token": "s3cret"}
+
+    r = client.get("/debug/loop_lag", headers=headers)
+
+    assert r.status_code == 200
+    profile_id = r.headers["x-profile-id"]
+    assert "x-profile-id" in r.headers["access-control-expose-headers"].lower()
+    profile = client.get(f"/debug/profiles/{profile_id}", headers={"X-Admin-Token": "s3cret"})
+    assert profile.status_code == 200
+
+
+def test_profiling_off_and_rejected_requests(client):
+    r = client.get("/debug/loop_lag", headers={"X-Profile": "0", "X-Admin-Token": "s3cret"})
+    assert r.status_code == 200
+    assert "x-profile-id" not in r.headers
+
+    r = client.get("/debug/loop_lag", headers={**ORIGIN, "X-Profile": "1", "X-Admin-Token": "wrong"})
+    assert r.status_code == 403
+    assert r.headers["access-control-allow-origin"]